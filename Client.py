@@ -1,18 +1,23 @@
 from typing import Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import asyncio
 import colorama
-import os
 import json
 import time
 import settings
+import Utils
+from .FileWatcher import FileWatcher
+from .PerfStats import perf
 from .DataHandler import (
     load_json_file,
-    erase_song_list,
-    song_unlock,
+    ResultsLog,
+    ClientState,
+    reconcile_song_list,
     generate_modded_paths,
     create_copies,
     restore_originals,
-    freeplay_song_list,
 )
 from CommonClient import (
     CommonContext,
@@ -24,6 +29,12 @@ from CommonClient import (
 )
 from NetUtils import NetworkItem, ClientStatus, Permission
 
+# File work runs on its own thread, the event loop waking up later than this is logged as a stall
+LOOP_LAG_TARGET = 0.05
+LOOP_LAG_INTERVAL = 0.1
+# A song sync that keeps failing is retried after twice as long each time, up to this many seconds
+SYNC_RETRY_MAX = 30
+
 
 class DivaClientCommandProcessor(ClientCommandProcessor):
     def _cmd_uncleared(self):
@@ -46,6 +57,11 @@ class DivaClientCommandProcessor(ClientCommandProcessor):
         """Toggle that restores or removes songs that aren't part of this AP run"""
         asyncio.create_task(self.ctx.freeplay_toggle())
 
+    def _cmd_perf(self):
+        """Shows how often and how long the client's busiest paths ran, and bytes read and written per pack"""
+        for line in perf.format_summary():
+            logger.info(line)
+
     def _cmd_restore_songs(self):
         """Restores songs to their original state for intended use"""
         logger.info("Restoring..")
@@ -53,6 +69,70 @@ class DivaClientCommandProcessor(ClientCommandProcessor):
         logger.info("Base Game + Mod Packs Restored")
 
 
+class ProgressTracker:
+    """
+    Received items and checked locations of a slot, kept in sets and counters and updated as each item or
+    check comes in, so commands and song syncs don't have to rebuild them from lists.
+    """
+
+    def __init__(self):
+        self.song_locations = {}  # Song id to its pair of location ids
+        self.missing = set()
+        self.checked = set()
+        self.cleared_songs = set()  # Songs with a checked location
+        self.received_index = 0  # How much of items_received has been processed
+        self.item_counts = Counter()
+        self.received_songs = set()
+        self.uncleared_songs = set()  # Received songs with a missing location
+
+    @property
+    def leeks(self) -> int:
+        return self.item_counts[1]
+
+    def set_locations(self, song_locations: dict, missing_locations, checked_locations):
+        self.song_locations = song_locations
+        self.missing = set(missing_locations)
+        self.checked = set(checked_locations)
+        self.cleared_songs = {location_id // 10 for location_id in self.checked}
+        self.uncleared_songs = {song_id for song_id in self.received_songs if self.is_uncleared(song_id)}
+
+    def is_uncleared(self, song_id: int) -> bool:
+        return not self.missing.isdisjoint(self.song_locations.get(song_id, ()))
+
+    def reset_items(self):
+        """Forget processed items, the next receive_items goes through all of items_received again."""
+        self.received_index = 0
+        self.item_counts.clear()
+        self.received_songs.clear()
+        self.uncleared_songs.clear()
+
+    def receive_items(self, items_received: list[NetworkItem]) -> list[NetworkItem]:
+        """Count the items past the cursor and return them."""
+        new_items = items_received[self.received_index:]
+        self.received_index += len(new_items)
+
+        for network_item in new_items:
+            self.item_counts[network_item.item] += 1
+            # Leeks are 1 and 2 is the filler item. Maybe move static items out of MegaMixCollection instead of hard coding?
+            if network_item.item not in (1, 2):
+                song_id = network_item.item // 10
+                self.received_songs.add(song_id)
+                if self.is_uncleared(song_id):
+                    self.uncleared_songs.add(song_id)
+
+        return new_items
+
+    def check_locations(self, location_ids):
+        """Mark locations as checked, whether sent by this client or collected."""
+        for location_id in location_ids:
+            self.checked.add(location_id)
+            self.missing.discard(location_id)
+            song_id = location_id // 10
+            self.cleared_songs.add(song_id)
+            if not self.is_uncleared(song_id):
+                self.uncleared_songs.discard(song_id)
+
+
 class MegaMixContext(CommonContext):
     """MegaMix Game Context"""
 
@@ -65,32 +145,53 @@ class MegaMixContext(CommonContext):
         self.path = settings.get_settings()["megamix_options"]["mod_path"]
         self.mod_pv = self.path + "/ArchipelagoMod/rom/mod_pv_db.txt"
         self.songResultsLocation = self.path + "/ArchipelagoMod/results.json"
+        self.songResultsLogLocation = self.path + "/ArchipelagoMod/results.jsonl"
+        self.results_log = ResultsLog(self.songResultsLogLocation, Utils.cache_path("megamix", "results_log.json"))
+        self.results_log_active = False  # Once the mod writes the results log, results.json is ignored
+        self.results_poll_interval = settings.get_settings()["megamix_options"]["results_poll_interval"] / 1000
+        self.results_written_ns = None
+        self.perf_dump = settings.get_settings()["megamix_options"]["perf_dump"]
         self.modData = None
         self.modded = False
         self.freeplay = False
         self.mod_pv_list = []
-        self.previous_received = []
+        self.song_pack_index = {}  # Song id to the name of the pack it's in, only for modded songs
+        self.pack_paths = {}  # Pack name to its mod_pv_db.txt
+        self.flush_window = settings.get_settings()["megamix_options"]["unlock_flush_window"] / 1000
+        self.song_sync_event = asyncio.Event()  # Set when the desired song list changed, handled by song_sync_writer
+        self.flush_count = 0
+        self.sync_failures = 0  # Song syncs failed in a row, the retries back off by this
+        self.last_sync_error = None
+        self.removed_songs = set()  # Song ids removed as cleared, hidden unless in freeplay
+        self.songs_restored = False
+        self.progress = ProgressTracker()
         self.sent_unlock_message = False
 
         self.items_handling = 0b001 | 0b010 | 0b100  #Receive items from other worlds, starting inv, and own items
         self.location_ids = None
         self.location_name_to_ap_id = None
         self.location_ap_id_to_name = None
+        self.location_song_index = {}  # Location id to song id
+        self.song_location_index = {}  # Song id to its pair of location ids
+        self.song_names = {}  # Song id to song name, from the location names
         self.item_name_to_ap_id = None
         self.item_ap_id_to_name = None
         self.checks_per_song = 2
         self.found_checks = []
-        self.missing_checks = []  # Stores all location checks found, for filtering
-        self.prev_found = []
 
         self.seed_name = None
+        self.room_info_event = asyncio.Event()  # Set once RoomInfo brought the seed name
+        self.packs_ready = asyncio.Event()  # Set once the packs are backed up for this connection
+        self.setup_task = None
+        self.data_package_checksum = None
+        self.data_package_maps = {}  # (checksum, location ids) to the id maps filtered to them
+        self.client_state = None  # What was last written for this seed and slot, see ClientState
         self.options = None
 
         self.goal_song = None
         self.goal_id = None
         self.autoRemove = False
         self.leeks_needed = None
-        self.leeks_obtained = 0
         self.grade_needed = None
 
         self.watch_task = None
@@ -98,7 +199,44 @@ class MegaMixContext(CommonContext):
             self.watch_task = asyncio.create_task(self.watch_json_file(self.songResultsLocation))
 
         self.obtained_items_queue = asyncio.Queue()
-        self.critical_section_lock = asyncio.Lock()
+        # All pack and state file writes go through this one thread, in the order they're submitted
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="megamix_io")
+        self.song_sync_writer_task = asyncio.create_task(self.song_sync_writer())
+        self.loop_lag_max = 0.0
+        self.loop_lag_task = asyncio.create_task(self.monitor_loop_lag())
+
+    async def shutdown(self):
+        self.song_sync_writer_task.cancel()
+        self.loop_lag_task.cancel()
+        if self.setup_task:
+            self.setup_task.cancel()
+        if self.song_sync_event.is_set():
+            await self.try_sync_song_list()
+        if self.client_state:
+            await self.run_io(self.client_state.hash_packs)
+            await self.save_client_state()
+        self.io_executor.shutdown()
+        if self.perf_dump:
+            perf.dump(self.perf_dump)
+        await super().shutdown()
+
+    async def run_io(self, func, *args):
+        """Run file work on the I/O thread without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, functools.partial(func, *args))
+
+    async def monitor_loop_lag(self):
+        """Measure how late the event loop wakes up, anything blocking it shows up here."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                start = loop.time()
+                await asyncio.sleep(LOOP_LAG_INTERVAL)
+                lag = loop.time() - start - LOOP_LAG_INTERVAL
+                self.loop_lag_max = max(self.loop_lag_max, lag)
+                if lag > LOOP_LAG_TARGET:
+                    logger.debug(f"Event loop stalled for {lag * 1000:.1f}ms")
+        except asyncio.CancelledError:
+            pass
 
     async def server_auth(self, password_requested: bool = False):
         if password_requested and not self.password:
@@ -111,10 +249,14 @@ class MegaMixContext(CommonContext):
         if cmd == "Connected":
 
             self.sent_unlock_message = False
-            self.leeks_obtained = 0
-            self.missing_checks = args["missing_locations"]
-            self.prev_found = args["checked_locations"]
+            self.songs_restored = False
+            # Removed songs and freeplay belong to the last seed, load_client_state brings back this seed's
+            self.removed_songs = set()
+            self.freeplay = False
+            self.progress.reset_items()
             self.location_ids = set(args["missing_locations"] + args["checked_locations"])
+            self.build_location_indexes()
+            self.progress.set_locations(self.song_location_index, args["missing_locations"], args["checked_locations"])
             self.options = args["slot_data"]
             self.goal_song = self.options["victoryLocation"]
             self.goal_id = self.options["victoryID"]
@@ -124,42 +266,35 @@ class MegaMixContext(CommonContext):
             self.modData = self.options["modData"]
             if self.modData:
                 self.modded = True
-                self.mod_pv_list = generate_modded_paths(self.modData, self.path)
-            self.mod_pv_list.append(self.mod_pv)
-            create_copies(self.mod_pv_list)
-            asyncio.create_task(self.send_msgs([{"cmd": "GetDataPackage", "games": ["Hatsune Miku Project Diva Mega Mix+"]}]))
-            self.check_goal()
-
-            # if we don't have the seed name from the RoomInfo packet, wait until we do.
-            while not self.seed_name:
-                time.sleep(1)
+            self.build_pack_indexes()
+            self.packs_ready.clear()
+            if self.setup_task:
+                self.setup_task.cancel()
+            self.setup_task = asyncio.create_task(self.setup_connection())
 
         if cmd == "ReceivedItems":
+            if args["index"] == 0:
+                # Full resync, items_received was replaced
+                self.progress.reset_items()
             # If receiving an item, only append that item
             asyncio.create_task(self.receive_item())
 
         if cmd == "RoomInfo":
             self.seed_name = args['seed_name']
+            self.data_package_checksum = args.get("datapackage_checksums", {}).get(self.game)
+            self.room_info_event.set()
 
         elif cmd == "DataPackage":
             if not self.location_ids:
                 # Connected package not recieved yet, wait for datapackage request after connected package
                 return
-            self.leeks_obtained = 0
-            self.previous_received = []
-
-            self.location_name_to_ap_id = args["data"]["games"]["Hatsune Miku Project Diva Mega Mix+"]["location_name_to_id"]
-            self.location_name_to_ap_id = {
-                name: loc_id for name, loc_id in
-                self.location_name_to_ap_id.items() if loc_id in self.location_ids
-            }
-            self.location_ap_id_to_name = {v: k for k, v in self.location_name_to_ap_id.items()}
-            self.item_name_to_ap_id = args["data"]["games"]["Hatsune Miku Project Diva Mega Mix+"]["item_name_to_id"]
-            self.item_ap_id_to_name = {v: k for k, v in self.item_name_to_ap_id.items()}
+            # CommonContext already caches the package for its checksum
+            game_data = args["data"]["games"]["Hatsune Miku Project Diva Mega Mix+"]
+            self.apply_data_package(game_data)
 
-            erase_song_list(self.mod_pv_list)
-            # If receiving data package, resync previous items
-            asyncio.create_task(self.receive_item())
+        elif cmd == "RoomUpdate":
+            if "checked_locations" in args and self.location_ids:
+                self.progress.check_locations(args["checked_locations"])
 
         elif cmd == "LocationInfo":
             if len(args["locations"]) > 1:
@@ -169,64 +304,246 @@ class MegaMixContext(CommonContext):
                 # request after an item is obtained
                 asyncio.create_task(self.obtained_items_queue.put(args["locations"][0]))
 
-    def song_id_to_pack(self, item_id):
-        target_song_id = int(item_id) // 10
+    async def setup_connection(self):
+        """
+        Backs up the packs in a worker thread while the DataPackage is loaded or requested,
+        song syncs wait until all of it is done.
+        """
+        start = time.perf_counter()
+        # A failed backup or DataPackage mustn't hold back every song sync, so the packs are ready regardless
+        results = await asyncio.gather(
+            self.run_io(create_copies, list(self.mod_pv_list)),
+            self.fetch_data_package(),
+            return_exceptions=True,
+        )
+        for step, result in zip(("Backing up the song packs", "Loading the DataPackage"), results):
+            if isinstance(result, Exception):
+                logger.error(f"{step} failed: {result!r}")
+        try:
+            self.load_client_state()
+        except Exception as e:
+            logger.error(f"Loading the client state failed: {e!r}")
+        self.packs_ready.set()
+        self.check_goal()
+        logger.debug(f"Connection setup took {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    async def fetch_data_package(self):
+        """Use the DataPackage cached for the checksum the server advertises, or request it."""
+        # if we don't have the seed name from the RoomInfo packet, wait until we do.
+        await self.room_info_event.wait()
+
+        if self.data_package_checksum:
+            game_data = Utils.load_data_package_for_checksum(self.game, self.data_package_checksum)
+            if game_data.get("checksum") == self.data_package_checksum:
+                logger.debug(f"Using the cached DataPackage {self.data_package_checksum}")
+                self.apply_data_package(game_data)
+                return
 
-        if self.modded:
-            for pack, ids in self.modData.items():
-                for songID in ids:
-                    if songID == target_song_id:
-                        return pack
-        return "ArchipelagoMod"
+        await self.send_msgs([{"cmd": "GetDataPackage", "games": ["Hatsune Miku Project Diva Mega Mix+"]}])
 
-    async def receive_item(self):
-        async with self.critical_section_lock:
-            ids_to_packs = {}
+    @perf.span("client.data_package")
+    def apply_data_package(self, game_data: dict):
+        self.progress.reset_items()
+
+        key = (game_data.get("checksum"), frozenset(self.location_ids))
+        if not key[0] or key not in self.data_package_maps:
+            location_name_to_ap_id = {
+                name: loc_id for name, loc_id in
+                game_data["location_name_to_id"].items() if loc_id in self.location_ids
+            }
+            location_ap_id_to_name = {v: k for k, v in location_name_to_ap_id.items()}
+            item_name_to_ap_id = game_data["item_name_to_id"]
+            self.data_package_maps[key] = (
+                location_name_to_ap_id,
+                location_ap_id_to_name,
+                {self.location_song_index[loc_id]: name[:-2] for loc_id, name in location_ap_id_to_name.items()},
+                item_name_to_ap_id,
+                {v: k for k, v in item_name_to_ap_id.items()},
+            )
+
+        (self.location_name_to_ap_id, self.location_ap_id_to_name, self.song_names,
+         self.item_name_to_ap_id, self.item_ap_id_to_name) = self.data_package_maps[key]
+
+        # If receiving data package, resync previous items
+        asyncio.create_task(self.receive_item())
+
+    def load_client_state(self):
+        """Pick up where the last session for this seed and slot left off."""
+        self.client_state = ClientState(Utils.cache_path("megamix", f"{self.seed_name}_{self.slot}.json"))
+        self.removed_songs = set(self.client_state.removed_songs)
+
+        # Results written while no client was running, the read position is shared by every seed
+        # so results another seed's session already read aren't sent again
+        if self.results_log.resume():
+            logger.info("Reading song results from while the client was closed")
+            self.read_results_log()
+
+        # Checks found before the last session ended but never acknowledged by the server
+        unsent = sorted((self.client_state.checked - self.progress.checked) & self.location_ids)
+        if unsent:
+            logger.info(f"Sending {len(unsent) // self.checks_per_song} song clear(s) from the last session")
+            send_pending = bool(self.found_checks)
+            self.found_checks.extend(location_id for location_id in unsent if location_id not in self.found_checks)
+            if not send_pending:
+                asyncio.create_task(self.send_checks())
 
-            for network_item in self.items_received:
-                if network_item not in self.previous_received:
-                    self.previous_received.append(network_item)
-                    if network_item.item == 1:
-                        self.leeks_obtained += 1
-                        self.check_goal()
-                    elif network_item.item == 2:
-                        # Maybe move static items out of MegaMixCollection instead of hard coding?
-                        pass
-                    else:
-                        ids_to_packs.setdefault(self.song_id_to_pack(network_item.item), []).append(network_item.item)
+    async def save_client_state(self):
+        if not self.client_state:
+            return
+        # Found checks count as well, so they're sent again if the client closes before the server got them
+        self.client_state.checked = self.progress.checked | set(self.found_checks)
+        self.client_state.removed_songs = set(self.removed_songs)
+        await self.run_io(self.client_state.save)
+        await self.run_io(self.results_log.save_position)
+
+    def build_pack_indexes(self):
+        """Index which pack every modded song is in, first pack wins if a song id is in more than one."""
+        self.song_pack_index = {}
+        for pack, ids in (self.modData or {}).items():
+            for song_id in ids:
+                self.song_pack_index.setdefault(song_id, pack)
+
+        self.pack_paths = generate_modded_paths(self.modData or {}, self.path)
+        self.pack_paths["ArchipelagoMod"] = self.mod_pv
+        # Backed up and restored as well as synced, so all three act on the same files
+        self.mod_pv_list = list(dict.fromkeys(self.pack_paths.values()))
+
+    def build_location_indexes(self):
+        """Index the song of every location in this slot, and the pair of locations of every song."""
+        self.location_song_index = {location_id: location_id // 10 for location_id in self.location_ids}
+        self.song_location_index = {}
+        for location_id in sorted(self.location_ids):
+            self.song_location_index.setdefault(location_id // 10, []).append(location_id)
+        self.song_location_index = {song_id: tuple(pair) for song_id, pair in self.song_location_index.items()}
 
-            for song_pack in ids_to_packs:
-                song_unlock(self.path, ids_to_packs.get(song_pack), False, song_pack)
+    async def receive_item(self):
+        with perf.span("client.receive_item"):
+            self.progress.receive_items(self.items_received)
 
+        if self.progress.leeks:
+            self.check_goal()
+        self.request_song_sync()
 
     def check_goal(self):
-        if self.leeks_obtained >= self.leeks_needed:
+        if self.progress.leeks >= self.leeks_needed:
             if not self.sent_unlock_message:
                 self.sent_unlock_message = True
                 logger.info(f"Got enough leeks! Unlocking goal song: {self.goal_song}")
 
-            song_pack = self.song_id_to_pack(self.goal_id)
-            song_unlock(self.path, [self.goal_id], False, song_pack)
+            self.request_song_sync()
 
+    def desired_song_states(self) -> dict:
+        """
+        Per pack path, the (unlock_ids, lock_ids, lock_others) song ids that make the in-game song list
+        match what has been received, cleared and toggled.
+        """
+        goal_song_id = self.goal_id // 10
+        unlocked = set(self.progress.received_songs)
+        if self.progress.leeks >= self.leeks_needed:
+            unlocked.add(goal_song_id)
+
+        if self.freeplay:
+            # Only hide the songs of this run that aren't available yet
+            hidden = (self.song_location_index.keys() | {goal_song_id}) - unlocked
+            return {path: (set(), hidden, False) for path in self.pack_paths.values()}
+
+        visible = {song_pack: set() for song_pack in self.pack_paths}
+        for song_id in unlocked - self.removed_songs:
+            visible[self.song_pack_index.get(song_id, "ArchipelagoMod")].add(song_id)
+        return {self.pack_paths[song_pack]: (song_ids, set(), True) for song_pack, song_ids in visible.items()}
+
+    def request_song_sync(self):
+        """Have the writer task bring the song packs in line with the desired song list."""
+        self.song_sync_event.set()
+
+    async def sync_song_list(self):
+        """Write the difference between the desired and the current song list, once per changed pack."""
+        self.song_sync_event.clear()
+        if self.goal_id is None or self.songs_restored or not self.packs_ready.is_set():
+            return
+
+        pack_states = self.desired_song_states()
+        received_index = self.progress.received_index
+        changes, synced, new_items = await self.run_io(self.write_song_list, pack_states, received_index)
+        await self.save_client_state()
+
+        self.flush_count += 1
+        changed = {path: count for path, count in changes.items() if count}
+        logger.debug(f"Song sync #{self.flush_count}: {new_items} new item(s), {sum(changed.values())} lines changed "
+                     f"in {len(changed)} of {len(changes)} pack(s), {synced} already in sync, "
+                     f"max loop lag {self.loop_lag_max * 1000:.1f}ms")
+        self.loop_lag_max = 0.0
+
+    def write_song_list(self, pack_states: dict, received_index: int) -> tuple[dict, int, int]:
+        """Runs on the I/O thread. Returns the lines changed per pack, the packs already in sync and the new items."""
+        # Packs still exactly as written for their desired state aren't loaded at all
+        pending = {path: pack_state for path, pack_state in pack_states.items()
+                   if not self.client_state.is_synced(path, pack_state)}
+        changes = reconcile_song_list(pending)
+
+        for path in pending:
+            self.client_state.mark_synced(path, pending[path])
+        new_items = received_index - self.client_state.received_index
+        self.client_state.received_index = received_index
+
+        return changes, len(pack_states) - len(pending), new_items
+
+    async def song_sync_writer(self):
+        """Gathers song list changes for flush_window seconds, then writes them in one go."""
+        try:
+            while True:
+                await self.song_sync_event.wait()
+                await self.packs_ready.wait()
+                await asyncio.sleep(min(self.flush_window * 2 ** self.sync_failures, SYNC_RETRY_MAX))
+                await self.try_sync_song_list()
+        except asyncio.CancelledError:
+            pass
+
+    async def try_sync_song_list(self) -> bool:
+        """sync_song_list, but a failure is logged and left for the writer to retry with whatever is desired by then."""
+        try:
+            await self.sync_song_list()
+        except Exception as e:
+            self.sync_failures += 1
+            # The same error again is only worth a debug line, it could repeat for as long as the client runs
+            if repr(e) != self.last_sync_error:
+                logger.error(f"Failed to update the song list, retrying: {e!r}")
+            else:
+                logger.debug(f"Song sync failed {self.sync_failures} times in a row: {e!r}")
+            self.last_sync_error = repr(e)
+            self.song_sync_event.set()
+            return False
+
+        if self.sync_failures:
+            logger.info(f"Song list updated after {self.sync_failures} failed attempt(s)")
+            self.sync_failures = 0
+            self.last_sync_error = None
+        return True
 
     async def watch_json_file(self, file_name: str):
         """Watch a JSON file for changes and call the callback function."""
-        file_path = os.path.join(os.path.dirname(__file__), file_name)
-        last_modified = os.path.getmtime(file_path)
+        watcher = FileWatcher([file_name, self.songResultsLogLocation], self.results_poll_interval)
         try:
-            while True:
-                await asyncio.sleep(1)  # Wait for a short duration
-                modified = os.path.getmtime(file_path)
-                if modified != last_modified:
-                    last_modified = modified
+            async for file_path, modified_ns in watcher.changes():
+                self.results_written_ns = modified_ns
+                perf.record("client.results_detected", (time.time_ns() - modified_ns) / 1e9)
+                if file_path == self.songResultsLogLocation:
+                    self.read_results_log()
+                elif not self.results_log_active:
                     try:
-                        json_data = load_json_file(file_name)
+                        json_data = load_json_file(file_path)
                         self.receive_location_check(json_data)
                     except (FileNotFoundError, json.JSONDecodeError) as e:
                         print(f"Error loading JSON file: {e}")
         except asyncio.CancelledError:
             print(f"Watch task for {file_name} was canceled.")
 
+    def read_results_log(self):
+        self.results_log_active = True
+        for song_data in self.results_log.read_new():
+            self.receive_location_check(song_data)
+
+    @perf.span("client.receive_location_check")
     def receive_location_check(self, song_data):
 
         logger.debug(song_data)
@@ -240,7 +557,7 @@ class MegaMixContext(CommonContext):
                     asyncio.create_task(self.end_goal())
                     return
 
-                if location_id in self.prev_found:
+                if location_id in self.progress.checked:
                     logger.info("No checks to send: Song checks previously sent or collected")
                     return
 
@@ -248,12 +565,18 @@ class MegaMixContext(CommonContext):
                     logger.info("No checks to send: Song not in song pool")
                     return
 
+                if location_id in self.found_checks:
+                    return
+
                 logger.info("Cleared song with appropriate grade!")
 
+                # A send is already pending when several results arrive at once, let it take these too
+                send_pending = bool(self.found_checks)
                 for i in range(2):
                     self.found_checks.append(location_id + i)
 
-                asyncio.create_task(self.send_checks())
+                if not send_pending:
+                    asyncio.create_task(self.send_checks())
             else:
                 logger.info(f"Song {song_data.get('pvName')} was not beaten with a high enough grade")
 
@@ -268,54 +591,34 @@ class MegaMixContext(CommonContext):
         await self.send_msgs(message)
 
     async def send_checks(self):
-        message = [{"cmd": 'LocationChecks', "locations": self.found_checks}]
-        await self.send_msgs(message)
-        self.remove_found_checks()
-        self.found_checks.clear()
+        with perf.span("client.send_checks"):
+            # Results arriving while this is sent start a new send
+            found_checks, self.found_checks = self.found_checks, []
+            message = [{"cmd": 'LocationChecks', "locations": found_checks}]
+            await self.send_msgs(message)
+            if self.results_written_ns:
+                logger.debug(f"Checks sent {(time.time_ns() - self.results_written_ns) / 1e6:.1f}ms after the results were written")
+                self.results_written_ns = None
+            self.progress.check_locations(found_checks)
+            await self.save_client_state()
         if self.autoRemove and not self.freeplay:
             await self.remove_songs()
 
-    def remove_found_checks(self):
-        self.prev_found += self.found_checks
-        self.missing_checks = [item for item in self.missing_checks if item not in self.found_checks]
-
     async def get_uncleared(self):
 
-        prev_items = []
-        missing_locations = set()  # Convert to set if it's not already
-        logged_pairs = set()  # To keep track of logged pairs
-
-        # Get a list of all item names that have been received
-        for network_item in self.previous_received:
-            item_id = network_item.item // 10
-            prev_items.append(item_id)
-
-        for location in self.missing_checks:
-            # Change location name to match item name
-            if location not in missing_locations:
-                if location // 10 in prev_items:
-                    missing_locations.add(location)
-
-        # Now log pairs of locations
-        for location in missing_locations:
-            pair_last_digit = location % 2
-            paired_location = location - pair_last_digit + (1 - pair_last_digit)  # Flip last digit
-
-            # Only log if the pair hasn't been logged yet
-            pair_key = (min(location, paired_location), max(location, paired_location))
-            if pair_key not in logged_pairs:
-                logger.info(f"{self.location_ap_id_to_name[location][:-2]} is uncleared")
-                logged_pairs.add(pair_key)
-
-        if self.leeks_obtained >= self.leeks_needed:
+        uncleared = sorted(self.progress.uncleared_songs)
+        for song_id in uncleared:
+            logger.info(f"{self.song_names[song_id]} is uncleared")
+
+        if self.progress.leeks >= self.leeks_needed:
             logger.info(f"Goal song: {self.goal_song} is unlocked.")
 
         # Check goal and if missingLocations is empty
-        if not missing_locations:
+        if not uncleared:
             logger.info("All available songs cleared")
 
     async def get_leek_info(self):
-        logger.info(f"You have {self.leeks_obtained} Leeks")
+        logger.info(f"You have {self.progress.leeks} Leeks")
         logger.info(f"You need {self.leeks_needed} Leeks total to unlock the goal song {self.goal_song}")
 
     async def toggle_remove_songs(self):
@@ -328,32 +631,16 @@ class MegaMixContext(CommonContext):
             logger.info("Auto Remove Set to Off")
 
     async def remove_songs(self):
-        finished_songs = self.prev_found[::self.checks_per_song]
-
-        ids_to_packs = {}
-        for item in finished_songs:
-            ids_to_packs.setdefault(self.song_id_to_pack(item), []).append(item)
-
-        for song_pack in ids_to_packs:
-            song_unlock(self.path, ids_to_packs.get(song_pack), True, song_pack)
+        self.removed_songs |= self.progress.cleared_songs
+        self.request_song_sync()
 
         logger.info("Removed songs!")
 
     async def freeplay_toggle(self):
         self.freeplay = not self.freeplay
-
-        song_ids = [location_id for location_id in list(self.location_ids)[::self.checks_per_song]
-                    if location_id not in [i.item for i in self.previous_received]]
-
-        if not self.freeplay:
-            song_ids = [received.item for received in self.previous_received if received.item in self.missing_checks]
-
-            if self.leeks_obtained >= self.leeks_needed:
-                song_ids.append(self.goal_id)
-        elif self.leeks_obtained < self.leeks_needed:
-            song_ids.append(self.goal_id)
-
-        freeplay_song_list(self.mod_pv_list, song_ids, self.freeplay)
+        await self.packs_ready.wait()
+        if not await self.try_sync_song_list():
+            return
 
         if self.freeplay:
             logger.info("Restored non-AP songs!")
@@ -361,7 +648,17 @@ class MegaMixContext(CommonContext):
             logger.info("Removed non-AP songs!")
 
     async def restore_songs(self):
+        # Leave the packs alone until the next connect
+        self.songs_restored = True
+        self.song_sync_event.clear()
+        await self.run_io(self.restore_packs)
+        await self.save_client_state()
+
+    def restore_packs(self):
+        """Runs on the I/O thread."""
         restore_originals(self.mod_pv_list)
+        if self.client_state:
+            self.client_state.packs.clear()
 
 
 def launch():
@@ -0,0 +1,152 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify, watching one directory for finished writes and renames into it."""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def read_names(self) -> set[str]:
+        """Names of the files with events since the last read."""
+        names = set()
+        while True:
+            try:
+                events = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+
+            offset = 0
+            while offset < len(events):
+                _, _, _, name_length = INOTIFY_EVENT.unpack_from(events, offset)
+                offset += INOTIFY_EVENT.size
+                names.add(os.fsdecode(events[offset:offset + name_length].rstrip(b"\0")))
+                offset += name_length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    """
+    Watches files in a single directory for writes. Uses inotify on Linux so nothing runs while idle,
+    and falls back to polling the modification times every poll_interval seconds elsewhere.
+    """
+
+    def __init__(self, file_paths: list[str], poll_interval: float):
+        self.file_paths = {os.path.basename(file_path): file_path for file_path in file_paths}
+        self.directory = os.path.dirname(file_paths[0])
+        self.poll_interval = poll_interval
+        self.mode = None
+        self.wakeups = 0
+        self.idle_since = time.monotonic()
+        self.idle_cpu_since = time.process_time()
+
+    async def changes(self):
+        """Yield (file_path, mtime_ns) every time one of the files is written."""
+        inotify = self.open_inotify()
+        self.mode = "inotify" if inotify else "polling"
+        logger.debug(f"Watching {', '.join(self.file_paths)} in {self.directory} by {self.mode}")
+
+        try:
+            changes = self.inotify_changes(inotify) if inotify else self.polling_changes()
+            async for file_path in changes:
+                self.log_idle_stats()
+                try:
+                    yield file_path, os.stat(file_path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+        finally:
+            self.log_idle_stats()
+            if inotify:
+                inotify.close()
+
+    def open_inotify(self):
+        if not sys.platform.startswith("linux") or not os.path.isdir(self.directory):
+            return None
+
+        try:
+            inotify = Inotify(self.directory)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"inotify unavailable, polling instead: {e}")
+            return None
+
+        # Loops without add_reader can't wait on the descriptor
+        try:
+            asyncio.get_running_loop().add_reader(inotify.fd, lambda: None)
+            asyncio.get_running_loop().remove_reader(inotify.fd)
+        except NotImplementedError:
+            inotify.close()
+            return None
+
+        return inotify
+
+    async def inotify_changes(self, inotify: Inotify):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(inotify.fd, readable.set)
+
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                self.wakeups += 1
+
+                for name in inotify.read_names():
+                    if name in self.file_paths:
+                        yield self.file_paths[name]
+        finally:
+            loop.remove_reader(inotify.fd)
+
+    async def polling_changes(self):
+        def modified_times():
+            times = {}
+            for file_path in self.file_paths.values():
+                try:
+                    times[file_path] = os.stat(file_path).st_mtime_ns
+                except OSError:
+                    times[file_path] = None
+            return times
+
+        last_modified = modified_times()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.wakeups += 1
+
+            modified = modified_times()
+            for file_path, modified_ns in modified.items():
+                if modified_ns is not None and modified_ns != last_modified[file_path]:
+                    yield file_path
+            last_modified = modified
+
+    def log_idle_stats(self):
+        """Log how many times the watcher woke up and how much CPU the client used since the last change."""
+        idle = time.monotonic() - self.idle_since
+        cpu = time.process_time() - self.idle_cpu_since
+        logger.debug(f"Watcher ({self.mode}) idle {idle:.1f}s: {self.wakeups} wakeups, "
+                     f"{cpu * 1000:.1f}ms client CPU ({cpu / idle * 100 if idle else 0:.2f}%)")
+
+        self.wakeups = 0
+        self.idle_since = time.monotonic()
+        self.idle_cpu_since = time.process_time()
@@ -4,14 +4,78 @@ from .SymbolFixer import fix_song_name
 from .MegaMixSongData import SONG_DATA
 
 # Python
-from typing import Dict, List
-from collections import ChainMap
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import ChainMap, OrderedDict
+from bisect import bisect_left, bisect_right
 
 from .DataHandler import (
     extract_mod_data_to_json,
 )
 
 
+DIFFICULTY_ORDER = ["[EASY]", "[NORMAL]", "[HARD]", "[EXTREME]", "[EXEXTREME]"]
+
+# Filter results kept for players with the same settings, the oldest is dropped past this
+FILTER_CACHE_SIZE = 256
+
+
+def get_relaxation_steps(rating_range: Tuple[float, float], diff_range: Tuple[int, int]) -> List[Tuple[float, float, int, int]]:
+    """
+    Every (lower rating, higher rating, lower difficulty, higher difficulty) search criteria generate_early tries in order,
+    ending with the widest. In most cases only the first is needed.
+    """
+    # Initial search criteria
+    lower_rating_threshold, higher_rating_threshold = rating_range
+    lower_diff_threshold, higher_diff_threshold = min(diff_range), max(diff_range)
+    steps = []
+
+    while True:
+        steps.append((lower_rating_threshold, higher_rating_threshold, lower_diff_threshold, higher_diff_threshold))
+
+        # If the above fails, we want to adjust the difficulty thresholds.
+        # Easier first, then harder
+        if lower_rating_threshold <= 1 and higher_rating_threshold >= 10 and higher_diff_threshold - lower_diff_threshold + 1 >= 5:
+            return steps
+        elif lower_rating_threshold <= 1:
+            if higher_rating_threshold > 10:
+                # Reset ratings, adjust diff. Maybe buff/nerf initial ratings when lowering/raising diff.
+                lower_rating_threshold, higher_rating_threshold = rating_range
+
+                if lower_diff_threshold <= 0 and higher_diff_threshold < 4: higher_diff_threshold += 1
+                if lower_diff_threshold > 0: lower_diff_threshold -= 1
+            else:
+                higher_rating_threshold += 0.5
+        else:
+            lower_rating_threshold -= 0.5
+
+
+def indices_to_mask(indices: Iterable[int]) -> int:
+    """Bitmask with the bit of every index set."""
+    indices = list(indices)
+    if not indices:
+        return 0
+
+    bits = bytearray(max(indices) // 8 + 1)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def mask_to_indices(mask: int) -> List[int]:
+    """Indices of the set bits of a bitmask, ascending."""
+    bits = bin(mask)[:1:-1]  # Lowest bit first
+    indices = []
+    i = bits.find("1")
+    while i != -1:
+        indices.append(i)
+        i = bits.find("1", i + 1)
+    return indices
+
+
+def count_mask(mask: int) -> int:
+    return bin(mask).count("1")
+
+
 class MegaMixCollections:
     """Contains all the data of MegaMix, loaded from songData.json"""
 
@@ -85,42 +149,155 @@ class MegaMixCollections:
             for i in range(2):
                 self.song_locations[f"{song_name}-{i}"] = (song_data.code + i)
 
-    def get_songs_with_settings(self, dlc: bool, mod_ids: List[int], allowed_diff: List[int], disallowed_singer: List[str], diff_lower: float, diff_higher: float) -> List[str]:
-        """Gets a list of all songs that match the filter settings. Difficulty thresholds are inclusive."""
-        filtered_list = []
+        self.build_catalog()
 
-        for songKey, songData in self.song_items.items():
+    def build_catalog(self):
+        """
+        Keep the song filters as columns of bitmasks, bit i standing for the i-th song in song_items,
+        so filtering the catalog is a handful of integer operations instead of a loop over every song.
+        """
+        self.catalog_keys = list(self.song_items)
+        self.catalog_index = {song_key: i for i, song_key in enumerate(self.catalog_keys)}
+        self.catalog_mask = (1 << len(self.catalog_keys)) - 1
 
-            singer_found = False
-            song_id = songData.songID
+        dlc, modded = [], []
+        self.song_id_indices: Dict[int, List[int]] = {}
+        singer_indices: Dict[str, List[int]] = {}
+        rating_indices: Dict[Tuple[int, float], List[int]] = {}
+        for i, (song_key, song_data) in enumerate(self.song_items.items()):
+            if song_data.DLC:
+                dlc.append(i)
+            if song_data.modded:
+                modded.append(i)
+            else:
+                # Singers are only filtered for base game songs
+                for singer in set(song_data.singers):
+                    singer_indices.setdefault(singer, []).append(i)
+            self.song_id_indices.setdefault(song_data.songID, []).append(i)
+            for diff, rating in self.get_difficulty_pairs(song_key):
+                rating_indices.setdefault((diff, rating), []).append(i)
 
-            # If song is DLC and DLC is disabled, skip song
-            if songData.DLC and not dlc:
-                continue
+        self.dlc_mask = indices_to_mask(dlc)
+        self.modded_mask = indices_to_mask(modded)
+        self.singer_masks = {singer: indices_to_mask(indices) for singer, indices in singer_indices.items()}
+
+        # Per difficulty, its ratings ascending and the songs with a chart rated at most each of them
+        self.rating_masks: Dict[int, Tuple[List[float], List[int]]] = {}
+        for (diff, rating), indices in sorted(rating_indices.items()):
+            ratings, masks = self.rating_masks.setdefault(diff, ([], []))
+            ratings.append(rating)
+            masks.append((masks[-1] if masks else 0) | indices_to_mask(indices))
+
+        # Shared by every player in the multiworld, so results are tuples that can't be changed under another player
+        self.filter_cache: OrderedDict[tuple, Tuple[str, ...]] = OrderedDict()
+        self.filter_cache_hits = 0
+        self.filter_cache_misses = 0
 
-            # Skip modded song if not intended for this player
-            if songData.modded and song_id not in mod_ids:
+    def get_songs_with_settings(self, dlc: bool, mod_ids: List[int], allowed_diff: List[int], disallowed_singer: List[str], diff_lower: float, diff_higher: float) -> Tuple[str, ...]:
+        """
+        Gets all songs that match the filter settings. Difficulty thresholds are inclusive.
+        Results are cached and shared, copy them before changing them.
+        """
+        key = (bool(dlc), frozenset(mod_ids), tuple(sorted(set(allowed_diff))), frozenset(disallowed_singer), float(diff_lower), float(diff_higher))
+
+        def get_songs():
+            song_mask = self.get_song_mask(dlc, mod_ids, disallowed_singer)
+            return self.mask_to_songs(song_mask & self.get_difficulty_mask(allowed_diff, diff_lower, diff_higher))
+
+        return self.get_cached_filter(key, get_songs)
+
+    def get_songs_without_difficulty(self, dlc: bool, mod_ids: List[int], disallowed_singer: List[str]) -> Tuple[str, ...]:
+        """
+        Gets all songs that match the filter settings other than difficulty.
+        Results are cached and shared, copy them before changing them.
+        """
+        key = (bool(dlc), frozenset(mod_ids), frozenset(disallowed_singer))
+        return self.get_cached_filter(key, lambda: self.mask_to_songs(self.get_song_mask(dlc, mod_ids, disallowed_singer)))
+
+    def count_songs_with_settings(self, dlc: bool, mod_ids: List[int], allowed_diff: List[int], disallowed_singer: List[str], diff_lower: float, diff_higher: float) -> int:
+        """How many songs get_songs_with_settings would give, without building the list."""
+        song_mask = self.get_song_mask(dlc, mod_ids, disallowed_singer)
+        return count_mask(song_mask & self.get_difficulty_mask(allowed_diff, diff_lower, diff_higher))
+
+    def find_relaxation_step(self, dlc: bool, mod_ids: List[int], disallowed_singer: List[str], rating_range: Tuple[float, float], diff_range: Tuple[int, int], needed: int) -> Optional[int]:
+        """
+        How many times generate_early would have to relax the difficulty thresholds to find the needed amount of songs,
+        or None if even the widest thresholds don't have enough. Plando songs are not taken into account.
+        """
+        song_mask = self.get_song_mask(dlc, mod_ids, disallowed_singer)
+        for step, (lower, higher, diff_lower, diff_higher) in enumerate(get_relaxation_steps(rating_range, diff_range)):
+            if count_mask(song_mask & self.get_difficulty_mask(range(diff_lower, diff_higher + 1), lower, higher)) >= needed:
+                return step
+        return None
+
+    def get_cached_filter(self, key: tuple, get_songs) -> Tuple[str, ...]:
+        if key in self.filter_cache:
+            self.filter_cache_hits += 1
+            self.filter_cache.move_to_end(key)
+            return self.filter_cache[key]
+
+        self.filter_cache_misses += 1
+        songs = tuple(get_songs())
+        self.filter_cache[key] = songs
+        if len(self.filter_cache) > FILTER_CACHE_SIZE:
+            self.filter_cache.popitem(last=False)
+        return songs
+
+    def filter_songs_by_difficulty(self, song_keys: List[str], allowed_diff: List[int], diff_lower: float, diff_higher: float) -> List[str]:
+        """Keeps the songs with a chart of an allowed difficulty within the rating thresholds, which are inclusive."""
+        matched = set(self.mask_to_songs(self.songs_to_mask(song_keys) & self.get_difficulty_mask(allowed_diff, diff_lower, diff_higher)))
+        return [song_key for song_key in song_keys if song_key in matched]
+
+    def get_song_mask(self, dlc: bool, mod_ids: List[int], disallowed_singer: List[str]) -> int:
+        """Bitmask of the songs that match the filter settings other than difficulty."""
+        song_mask = self.catalog_mask
+
+        # If song is DLC and DLC is disabled, skip song
+        if not dlc:
+            song_mask &= ~self.dlc_mask
+
+        # Skip modded songs not intended for this player,
+        # and do not give base game versions if a modded cover is available for this player
+        mod_id_mask = indices_to_mask(i for song_id in set(mod_ids) for i in self.song_id_indices.get(song_id, ()))
+        song_mask &= ~(self.modded_mask & ~mod_id_mask)
+        song_mask &= ~(mod_id_mask & ~self.modded_mask)
+
+        # Skip songs with a disallowed singer
+        for singer in disallowed_singer:
+            song_mask &= ~self.singer_masks.get(singer, 0)
+
+        return song_mask
+
+    def get_difficulty_mask(self, allowed_diff: Iterable[int], diff_lower: float, diff_higher: float) -> int:
+        """Bitmask of the songs with a chart of an allowed difficulty within the rating thresholds, which are inclusive."""
+        difficulty_mask = 0
+        for diff in set(allowed_diff):
+            if diff not in self.rating_masks:
                 continue
 
-            # Do not give base game version if modded cover available for this player
-            if not songData.modded and song_id in mod_ids:
+            ratings, masks = self.rating_masks[diff]
+            higher = bisect_right(ratings, diff_higher) - 1
+            lower = bisect_left(ratings, diff_lower) - 1
+            if higher < 0:
                 continue
+            difficulty_mask |= masks[higher] & ~masks[lower] if lower >= 0 else masks[higher]
+
+        return difficulty_mask
+
+    def songs_to_mask(self, song_keys: Iterable[str]) -> int:
+        return indices_to_mask(self.catalog_index[song_key] for song_key in song_keys)
+
+    def mask_to_songs(self, song_mask: int) -> List[str]:
+        """Song keys of a bitmask, in catalog order."""
+        return [self.catalog_keys[i] for i in mask_to_indices(song_mask)]
+
+    def get_difficulty_pairs(self, song_key: str) -> List[Tuple[int, float]]:
+        """(difficulty index, rating) of every chart of a song."""
+        song_data = self.song_items[song_key]
+        return [(DIFFICULTY_ORDER.index(diff), rating) for diff, rating in zip(song_data.difficulties, song_data.difficultyRatings)]
 
-            # Skip song if disallowed singer is found
-            if not songData.modded:
-                for singer in disallowed_singer:
-                    if singer in songData.singers:
-                        singer_found = True
-                if singer_found:
-                    continue
-
-            # Check if song has a valid difficulty and rating for settings
-            difficulty_indices = [["[EASY]", "[NORMAL]", "[HARD]", "[EXTREME]", "[EXEXTREME]"].index(d) for d in songData.difficulties]
-            for i, diff in enumerate(difficulty_indices):
-                if diff in allowed_diff:
-                    if diff_lower <= songData.difficultyRatings[i] <= diff_higher:
-                        # Append the song to the selected_songs list
-                        filtered_list.append(songData.songName)
-                        break
-
-        return filtered_list
+    def count_songs_per_step(self, song_keys: List[str], steps: List[Tuple[float, float, int, int]]) -> List[int]:
+        """How many of the songs match each (lower rating, higher rating, lower difficulty, higher difficulty) step."""
+        song_mask = self.songs_to_mask(song_keys)
+        return [count_mask(song_mask & self.get_difficulty_mask(range(diff_lower, diff_higher + 1), lower, higher))
+                for lower, higher, diff_lower, diff_higher in steps]
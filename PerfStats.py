@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Percentiles are taken over the most recent samples of each span
+MAX_SAMPLES = 1024
+
+
+class Span:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def percentile(self, fraction: float) -> float:
+        samples = sorted(self.samples)
+        return samples[int(fraction * (len(samples) - 1))] if samples else 0.0
+
+
+class PerfStats:
+    """
+    Counts and timings of the client's hot paths, and bytes read and written per pack.
+    Shared between the event loop and the I/O threads, so every update takes a lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: dict[str, Span] = {}
+        self.pack_bytes: dict[str, list[int]] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            span = self.spans.setdefault(name, Span())
+            span.count += 1
+            span.total += seconds
+            span.samples.append(seconds)
+
+    def add_bytes(self, file_path: str, read: int = 0, written: int = 0):
+        with self.lock:
+            pack_bytes = self.pack_bytes.setdefault(file_path, [0, 0])
+            pack_bytes[0] += read
+            pack_bytes[1] += written
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "spans": {name: {
+                    "count": span.count,
+                    "total_ms": span.total * 1000,
+                    "p50_ms": span.percentile(0.5) * 1000,
+                    "p95_ms": span.percentile(0.95) * 1000,
+                } for name, span in sorted(self.spans.items())},
+                "packs": {file_path: {"bytes_read": read, "bytes_written": written}
+                          for file_path, (read, written) in sorted(self.pack_bytes.items())},
+            }
+
+    def format_summary(self) -> list[str]:
+        summary = self.summary()
+        if not summary["spans"] and not summary["packs"]:
+            return ["Nothing measured yet"]
+
+        lines = [f"{name}: {span['count']}x, total {span['total_ms']:.1f}ms, "
+                 f"p50 {span['p50_ms']:.1f}ms, p95 {span['p95_ms']:.1f}ms"
+                 for name, span in summary["spans"].items()]
+        lines += [f"{file_path}: {pack['bytes_read']} bytes read, {pack['bytes_written']} bytes written"
+                  for file_path, pack in summary["packs"].items()]
+        return lines
+
+    def dump(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+perf = PerfStats()
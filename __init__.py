@@ -9,13 +9,13 @@ import settings
 from .Options import MegaMixOptions
 from .Items import MegaMixSongItem, MegaMixFixedItem
 from .Locations import MegaMixLocation
-from .MegaMixCollection import MegaMixCollections
+from .MegaMixCollection import MegaMixCollections, get_relaxation_steps
 from .DataHandler import get_player_specific_ids
 
 #Python
 import typing
 import json
-from typing import List
+from typing import List, Tuple
 from math import floor
 
 
@@ -55,6 +55,29 @@ class MegaMixSettings(settings.Group):
 
     mod_path: ModPath = ModPath("C:/Program Files (x86)/Steam/steamapps/common/Hatsune Miku Project DIVA Mega Mix Plus/mods")
 
+    class UnlockFlushWindow(int):
+        """
+        How long in milliseconds the Mega Mix Client gathers received songs before writing them to the song packs.
+        Larger values mean fewer writes when many items arrive at once, such as a release or collect.
+        """
+
+    unlock_flush_window: UnlockFlushWindow = UnlockFlushWindow(250)
+
+    class ResultsPollInterval(int):
+        """
+        How often in milliseconds the Mega Mix Client checks for song results when it can't be notified of them.
+        Only used where file change notifications (Linux inotify) are unavailable.
+        """
+
+    results_poll_interval: ResultsPollInterval = ResultsPollInterval(1000)
+
+    class PerfDump(str):
+        """
+        File the Mega Mix Client writes its /perf timings to as JSON when it exits. Leave empty to not write it.
+        """
+
+    perf_dump: PerfDump = PerfDump("")
+
 
 class MegaMixWorld(World):
     """Hatsune Miku: Project Diva Mega Mix+ is a rhythm game where you hit notes to the beat of one of 250+ songs.
@@ -88,51 +111,37 @@ class MegaMixWorld(World):
 
     def generate_early(self):
 
-        # Initial search criteria
-        lower_rating_threshold, higher_rating_threshold = self.get_difficulty_range()
-        lower_diff_threshold, higher_diff_threshold = self.get_available_difficulties(self.options.song_difficulty_min.value, self.options.song_difficulty_max.value)
         disallowed_singers = self.options.exclude_singers.value
-
-        while True:
-            # In most cases this should only need to run once
-
-            allowed_difficulties = list(range(lower_diff_threshold, higher_diff_threshold + 1))
-            available_song_keys = self.mm_collection.get_songs_with_settings(self.options.allow_megamix_dlc_songs, get_player_specific_ids(self.options.megamix_mod_data.value), allowed_difficulties, disallowed_singers, lower_rating_threshold, higher_rating_threshold)
-
-            available_song_keys = self.handle_plando(available_song_keys)
-            #print(f"{lower_rating_threshold}~{higher_rating_threshold}* {allowed_difficulties}", len(available_song_keys))
-
-            # The minimum amount of songs to make an ok rando would be Starting Songs + 10 interim songs + Goal song.
-            # - Interim songs being equal to max starting song count.
-            count_needed_for_start = max(0, self.options.starting_song_count.value - len(self.starting_songs)) + 11
-            if len(available_song_keys) + len(self.included_songs) >= count_needed_for_start:
-                final_song_list = available_song_keys
-                break
-
-            # If the above fails, we want to adjust the difficulty thresholds.
-            # Easier first, then harder
-            if lower_rating_threshold <= 1 and higher_rating_threshold >= 10 and len(allowed_difficulties) >= 5:
-                raise Exception("Failed to find enough songs, even with maximum difficulty thresholds.")
-            elif lower_rating_threshold <= 1:
-                if higher_rating_threshold > 10:
-                    # Reset ratings, adjust diff. Maybe buff/nerf initial ratings when lowering/raising diff.
-                    lower_rating_threshold, higher_rating_threshold = self.get_difficulty_range()
-
-                    if lower_diff_threshold <= 0 and higher_diff_threshold < 4: higher_diff_threshold += 1
-                    if lower_diff_threshold > 0: lower_diff_threshold -= 1
-
-                    lower_diff_threshold, higher_diff_threshold = self.get_available_difficulties(lower_diff_threshold, higher_diff_threshold)
-                else:
-                    higher_rating_threshold += 0.5
-            else:
-                lower_rating_threshold -= 0.5
+        mod_ids = get_player_specific_ids(self.options.megamix_mod_data.value)
+        # Shared with other players with the same settings, handle_plando makes this player's own copy
+        candidate_song_keys = self.mm_collection.get_songs_without_difficulty(self.options.allow_megamix_dlc_songs, mod_ids, disallowed_singers)
+        candidate_song_keys = self.handle_plando(candidate_song_keys)
+
+        # The minimum amount of songs to make an ok rando would be Starting Songs + 10 interim songs + Goal song.
+        # - Interim songs being equal to max starting song count.
+        count_needed_for_start = max(0, self.options.starting_song_count.value - len(self.starting_songs)) + 11
+
+        # Count every step at once rather than filtering the whole catalog again per step
+        steps = self.get_relaxation_steps()
+        counts = self.mm_collection.count_songs_per_step(candidate_song_keys, steps)
+        step = next((i for i, count in enumerate(counts) if count + len(self.included_songs) >= count_needed_for_start), None)
+        if step is None:
+            raise Exception("Failed to find enough songs, even with maximum difficulty thresholds.")
+
+        lower_rating_threshold, higher_rating_threshold, lower_diff_threshold, higher_diff_threshold = steps[step]
+        allowed_difficulties = list(range(lower_diff_threshold, higher_diff_threshold + 1))
+        final_song_list = self.mm_collection.filter_songs_by_difficulty(candidate_song_keys, allowed_difficulties, lower_rating_threshold, higher_rating_threshold)
 
         self.create_song_pool(final_song_list)
 
         for song in self.starting_songs:
             self.multiworld.push_precollected(self.create_item(song))
 
-    def handle_plando(self, available_song_keys: List[str]) -> List[str]:
+    def get_relaxation_steps(self) -> List[Tuple[float, float, int, int]]:
+        diff_range = self.get_available_difficulties(self.options.song_difficulty_min.value, self.options.song_difficulty_max.value)
+        return get_relaxation_steps(tuple(self.get_difficulty_range()), tuple(diff_range))
+
+    def handle_plando(self, available_song_keys: typing.Sequence[str]) -> List[str]:
         song_items = self.mm_collection.song_items
 
         start_items = self.options.start_inventory.value.keys()
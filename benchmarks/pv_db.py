@@ -0,0 +1,207 @@
+"""
+Benchmarks for the DataHandler pv_db patch operations, run offline against copies of sorted_mod_pv_db.txt.
+
+From the Archipelago root:
+    python -m worlds.megamix.benchmarks.pv_db --packs 1 8 32 --scale 1 4 --output bench_output.json
+
+Each pack is a copy of sorted_mod_pv_db.txt, repeated `scale` times with its song ids shifted so that every
+pack and repetition has its own ids. Results are written as JSON so runs can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from .. import DataHandler
+from ..DataHandler import (
+    ClientState,
+    create_copies,
+    get_pv_db,
+    reconcile_song_list,
+    restore_originals,
+    sibling_path,
+)
+
+SOURCE_PV_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sorted_mod_pv_db.txt")
+# Share of every pack's songs already received when connecting
+RECEIVED_SHARE = 4
+
+
+def create_packs(directory: str, pack_count: int, scale: int) -> tuple[list[str], list[list[int]]]:
+    """Write pack_count synthetic packs and return their paths and song ids."""
+    with open(SOURCE_PV_DB, 'r', encoding='utf-8') as file:
+        source = file.read()
+    source_ids = sorted({int(song_id) for song_id in re.findall(r"^pv_(\d+)\.", source, re.MULTILINE)})
+    id_span = max(source_ids) + 1
+
+    paths = []
+    pack_ids = []
+    for pack in range(pack_count):
+        pieces = []
+        song_ids = []
+        for repetition in range(scale):
+            shift = (pack * scale + repetition) * id_span
+            pieces.append(re.sub(r"^pv_(\d+)\.", lambda match: f"pv_{int(match.group(1)) + shift:03}.", source, flags=re.MULTILINE))
+            song_ids += [song_id + shift for song_id in source_ids]
+
+        path = os.path.join(directory, f"pack_{pack}", "rom", "mod_pv_db.txt")
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write("".join(pieces))
+        paths.append(path)
+        pack_ids.append(song_ids)
+
+    return paths, pack_ids
+
+
+def batch_sizes(limit: int) -> list[int]:
+    """Powers of ten up to limit, then limit itself, so the largest batch always fits the pack."""
+    sizes = []
+    size = 1
+    while size < limit:
+        sizes.append(size)
+        size *= 10
+    return sizes + [limit] if limit else sizes
+
+
+def measure(action, setup=None, repeat: int = 5) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        action()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3), "runs": repeat}
+
+
+def run_benchmarks(pack_count: int, scale: int, repeat: int) -> list[dict]:
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths, pack_ids = create_packs(directory, pack_count, scale)
+        DataHandler.BACKUP_STORE = os.path.join(directory, "megamix_backups")
+        context = {
+            "packs": pack_count,
+            "songs_per_pack": len(pack_ids[0]),
+            "pack_bytes": os.path.getsize(paths[0]),
+        }
+
+        def record(name: str, result: dict, **extra):
+            results.append({"name": name, **context, **extra, **result})
+            print(f"{name:<24} packs={pack_count:<3} songs/pack={context['songs_per_pack']:<6} "
+                  f"{' '.join(f'{k}={v}' for k, v in extra.items()):<12} median {result['median_ms']:>9.3f}ms")
+
+        # Desired states as the client builds them: received songs visible and everything else locked
+        received = {path: set(song_ids[:len(song_ids) // RECEIVED_SHARE]) for path, song_ids in zip(paths, pack_ids)}
+        connected = {path: (song_ids, set(), True) for path, song_ids in received.items()}
+        client_state = ClientState(os.path.join(directory, "client_state.json"))
+
+        def sync(pack_states: dict):
+            """What the client's write_song_list does, packs still as last written aren't loaded at all."""
+            pending = {path: pack_state for path, pack_state in pack_states.items() if not client_state.is_synced(path, pack_state)}
+            reconcile_song_list(pending)
+            for path, pack_state in pending.items():
+                client_state.mark_synced(path, pack_state)
+
+        def reset():
+            restore_originals(paths)
+            DataHandler._pv_dbs.clear()
+            client_state.packs.clear()
+
+        def reset_loaded():
+            reset()
+            for path in paths:
+                get_pv_db(path)
+
+        def reset_connected():
+            reset()
+            sync(connected)
+
+        def reset_backups():
+            reset()
+            for path in paths:
+                for backup_path in (sibling_path(path, "COPY"), sibling_path(path, "BACKUP", ".json")):
+                    if os.path.exists(backup_path):
+                        os.remove(backup_path)
+            shutil.rmtree(DataHandler.BACKUP_STORE, ignore_errors=True)
+
+        def create_blob_copies():
+            # Where the filesystem can't reflink, every pack is compressed into the backup store
+            reflink, DataHandler.reflink = DataHandler.reflink, lambda source_path, target_path: False
+            try:
+                create_copies(paths)
+            finally:
+                DataHandler.reflink = reflink
+
+        record("create_copies", measure(lambda: create_copies(paths), reset_backups, repeat))
+        record("create_copies (blobs)", measure(create_blob_copies, reset_backups, repeat))
+        record("create_copies up to date", measure(lambda: create_copies(paths), None, repeat))
+
+        record("load", measure(lambda: [get_pv_db(path) for path in paths], reset, repeat))
+        record("reconcile connect", measure(lambda: sync(connected), reset_loaded, repeat))
+        record("reconcile in sync", measure(lambda: sync(connected), reset_connected, repeat))
+
+        # Received and removed batches are at most as large as the songs received or left in the pack
+        pending_ids = pack_ids[0][len(received[paths[0]]):]
+        for batch_size in batch_sizes(min(len(pending_ids), len(received[paths[0]]))):
+            unlocked = connected | {paths[0]: (received[paths[0]] | set(pending_ids[:batch_size]), set(), True)}
+            removed = connected | {paths[0]: (set(sorted(received[paths[0]])[batch_size:]), set(), True)}
+            record("reconcile receive", measure(lambda: sync(unlocked), reset_connected, repeat), batch=batch_size)
+            record("reconcile remove", measure(lambda: sync(removed), reset_connected, repeat), batch=batch_size)
+
+        # Freeplay shows every song but the ones of the run that aren't received yet
+        freeplay = {path: (set(), set(song_ids[::RECEIVED_SHARE]) - received[path], False) for path, song_ids in zip(paths, pack_ids)}
+        record("reconcile freeplay on", measure(lambda: sync(freeplay), reset_connected, repeat))
+        record("reconcile freeplay off", measure(lambda: sync(connected), lambda: (reset_connected(), sync(freeplay)), repeat))
+        record("restore_originals", measure(lambda: restore_originals(paths), reset_connected, repeat))
+
+        reset()
+
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(SOURCE_PV_DB),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Mega Mix pv_db patch operations.")
+    parser.add_argument("--packs", type=int, nargs="+", default=[1, 8, 32], help="Pack counts to run with")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 4], help="Copies of the source songs per pack")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the median is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    # Per pack debug timings would drown out the results
+    DataHandler.logger.setLevel("INFO")
+
+    results = []
+    for scale in args.scale:
+        for pack_count in args.packs:
+            results += run_benchmarks(pack_count, scale, args.repeat)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmarks for MegaMixCollections.get_songs_with_settings against the per song loop it replaced.
+
+From the Archipelago root:
+    python -m worlds.megamix.benchmarks.song_filter --songs 250 5000 50000 --output bench_output.json
+
+Catalogs larger than the base game are filled up with synthetic modded songs with random charts,
+some of them covers of base game songs. Every query is checked to give the same songs in the same order.
+"""
+import argparse
+import json
+import platform
+import random
+
+from ..Items import SongData
+from ..MegaMixCollection import DIFFICULTY_ORDER, MegaMixCollections
+from ..MegaMixSongData import SONG_DATA
+from .pv_db import git_revision, measure
+
+FIRST_MOD_ID = 5000
+
+
+def create_catalog(song_count: int, seed: int = 0) -> MegaMixCollections:
+    """The base game songs, plus synthetic modded songs up to song_count."""
+    rng = random.Random(seed)
+    song_items = dict(SONG_DATA)
+    base_ids = [song_data.songID for song_data in SONG_DATA.values() if song_data.songID is not None]
+
+    for i in range(max(0, song_count - len(song_items))):
+        cover = rng.random() < 0.05
+        song_id = rng.choice(base_ids) if cover else FIRST_MOD_ID + i
+        difficulties, ratings = [], []
+        for difficulty in DIFFICULTY_ORDER:
+            if rng.random() < 0.6:
+                difficulties.append(difficulty)
+                ratings.append(rng.randint(2, 20) / 2)
+        song_name = f"Synthetic {i} [{song_id}]"
+        song_items[song_name] = SongData(song_id * 10 + cover, song_id, song_name, [], False, True, difficulties, ratings)
+
+    collection = MegaMixCollections.__new__(MegaMixCollections)
+    collection.song_items = song_items
+    collection.build_catalog()
+    return collection
+
+
+def legacy_get_songs_with_settings(collection: MegaMixCollections, dlc, mod_ids, allowed_diff, disallowed_singer, diff_lower, diff_higher):
+    """The per song loop get_songs_with_settings used before the bitmask catalog."""
+    filtered_list = []
+
+    for songKey, songData in collection.song_items.items():
+
+        singer_found = False
+        song_id = songData.songID
+
+        if songData.DLC and not dlc:
+            continue
+        if songData.modded and song_id not in mod_ids:
+            continue
+        if not songData.modded and song_id in mod_ids:
+            continue
+        if not songData.modded:
+            for singer in disallowed_singer:
+                if singer in songData.singers:
+                    singer_found = True
+            if singer_found:
+                continue
+
+        difficulty_indices = [DIFFICULTY_ORDER.index(d) for d in songData.difficulties]
+        for i, diff in enumerate(difficulty_indices):
+            if diff in allowed_diff:
+                if diff_lower <= songData.difficultyRatings[i] <= diff_higher:
+                    filtered_list.append(songData.songName)
+                    break
+
+    return filtered_list
+
+
+def create_queries(collection: MegaMixCollections) -> dict[str, tuple]:
+    # The loop checks mod ids against a list, so these are capped to keep it from taking minutes
+    modded_ids = sorted({song_data.songID for song_data in collection.song_items.values() if song_data.modded})
+
+    return {
+        "defaults": (True, [], [0, 1, 2, 3, 4], [], 1, 10),
+        "narrow": (False, [], [3], ["Hatsune Miku"], 7, 8.5),
+        "100 mods": (True, modded_ids[:100], [2, 3, 4], ["KAITO", "MEIKO"], 5, 9),
+        "1000 mods": (True, modded_ids[:1000], [0, 1, 2, 3, 4], [], 1, 10),
+    }
+
+
+def run_benchmarks(song_count: int, repeat: int) -> list[dict]:
+    results = []
+    collection = create_catalog(song_count)
+
+    for query_name, query in create_queries(collection).items():
+        expected = legacy_get_songs_with_settings(collection, *query)
+        if list(collection.get_songs_with_settings(*query)) != expected:
+            raise AssertionError(f"get_songs_with_settings differs from the loop for {query_name} at {song_count} songs")
+
+        legacy = measure(lambda: legacy_get_songs_with_settings(collection, *query), repeat=repeat)
+        bitmask = measure(lambda: collection.get_songs_with_settings(*query), collection.filter_cache.clear, repeat)
+        speedup = round(legacy["median_ms"] / max(bitmask["median_ms"], 1e-6), 1)
+
+        results.append({"name": query_name, "songs": len(collection.song_items), "matches": len(expected),
+                        "legacy": legacy, "bitmask": bitmask, "speedup": speedup})
+        print(f"{query_name:<10} songs={len(collection.song_items):<6} matches={len(expected):<6} "
+              f"loop {legacy['median_ms']:>9.3f}ms  bitmask {bitmask['median_ms']:>9.3f}ms  {speedup}x")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Mega Mix song filter.")
+    parser.add_argument("--songs", type=int, nargs="+", default=[250, 5000, 50000], help="Catalog sizes to run with")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the median is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    for song_count in args.songs:
+        results += run_benchmarks(song_count, args.repeat)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
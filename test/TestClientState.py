@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .. import DataHandler
+from ..DataHandler import ClientState
+
+
+class TestClientState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pack_path = os.path.join(self.directory.name, "mod_pv_db.txt")
+        self.state_path = os.path.join(self.directory.name, "cache", "seed_1.json")
+        with open(self.pack_path, "w") as file:
+            file.write("pv_001.difficulty.easy.length=1\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        state = ClientState(self.state_path)
+        pack_state = ({1}, set(), True)
+        state.mark_synced(self.pack_path, pack_state)
+        state.received_index = 3
+        state.checked = {10, 11}
+        state.save()
+
+        state = ClientState(self.state_path)
+        self.assertTrue(state.is_synced(self.pack_path, pack_state))
+        self.assertFalse(state.is_synced(self.pack_path, ({1, 2}, set(), True)))
+        self.assertEqual(state.received_index, 3)
+        self.assertEqual(state.checked, {10, 11})
+
+    def test_changed_pack_is_not_synced(self):
+        state = ClientState(self.state_path)
+        pack_state = ({1}, set(), True)
+        state.mark_synced(self.pack_path, pack_state)
+        with open(self.pack_path, "w") as file:
+            file.write("#A#001.difficulty.easy.length=1\n")
+        self.assertFalse(state.is_synced(self.pack_path, pack_state))
+
+    def test_touched_pack_with_same_content_is_synced(self):
+        state = ClientState(self.state_path)
+        pack_state = ({1}, set(), False)
+        state.mark_synced(self.pack_path, pack_state)
+        state.hash_packs()
+        os.utime(self.pack_path, ns=(0, 0))
+        self.assertTrue(state.is_synced(self.pack_path, pack_state))
+
+    def test_writes_are_not_hashed(self):
+        state = ClientState(self.state_path)
+        pack_state = ({1}, set(), False)
+        with mock.patch.object(DataHandler, "hash_file") as hash_file:
+            state.mark_synced(self.pack_path, pack_state)
+            self.assertTrue(state.is_synced(self.pack_path, pack_state))
+        hash_file.assert_not_called()
+
+        # Without a hash, a touched pack can't be told apart from a changed one
+        os.utime(self.pack_path, ns=(0, 0))
+        self.assertFalse(state.is_synced(self.pack_path, pack_state))
@@ -0,0 +1,51 @@
+import unittest
+
+from NetUtils import NetworkItem
+
+from ..Client import MegaMixContext, ProgressTracker
+
+
+class TestDesiredSongStates(unittest.TestCase):
+    def setUp(self):
+        # Only the state desired_song_states reads, without connecting anywhere
+        self.ctx = MegaMixContext.__new__(MegaMixContext)
+        self.ctx.goal_id = 50
+        self.ctx.leeks_needed = 2
+        self.ctx.freeplay = False
+        self.ctx.removed_songs = set()
+        self.ctx.song_location_index = {1: (10, 11), 2: (20, 21), 4950: (49500, 49501)}
+        self.ctx.song_pack_index = {4950: "TestPack"}
+        self.ctx.pack_paths = {"TestPack": "TestPack/rom/mod_pv_db.txt", "ArchipelagoMod": "ArchipelagoMod/rom/mod_pv_db.txt"}
+        self.ctx.progress = ProgressTracker()
+        self.ctx.progress.set_locations(self.ctx.song_location_index, [11, 20, 21, 49500, 49501], [10])
+        self.items = [NetworkItem(10, 1, 1), NetworkItem(49500, 2, 1), NetworkItem(1, 3, 1)]
+        self.ctx.progress.receive_items(self.items)
+
+    def test_received_songs_per_pack(self):
+        self.assertEqual(self.ctx.desired_song_states(), {
+            "TestPack/rom/mod_pv_db.txt": ({4950}, set(), True),
+            "ArchipelagoMod/rom/mod_pv_db.txt": ({1}, set(), True),
+        })
+
+    def test_goal_song_with_enough_leeks(self):
+        self.items.append(NetworkItem(1, 4, 1))
+        self.ctx.progress.receive_items(self.items)
+        self.assertEqual(self.ctx.desired_song_states()["ArchipelagoMod/rom/mod_pv_db.txt"], ({1, 5}, set(), True))
+
+    def test_removed_songs_are_hidden(self):
+        self.ctx.removed_songs = {1}
+        self.assertEqual(self.ctx.desired_song_states()["ArchipelagoMod/rom/mod_pv_db.txt"], (set(), set(), True))
+
+    def test_freeplay_only_hides_unavailable_songs(self):
+        self.ctx.freeplay = True
+        self.ctx.removed_songs = {1}
+        for pack_state in self.ctx.desired_song_states().values():
+            self.assertEqual(pack_state, (set(), {2, 5}, False))
+
+    def test_pack_paths_match_backed_up_packs(self):
+        self.ctx.path = "mods"
+        self.ctx.mod_pv = "mods/ArchipelagoMod/rom/mod_pv_db.txt"
+        self.ctx.modData = {"Test/Pack": [4950]}
+        self.ctx.build_pack_indexes()
+        self.assertEqual(self.ctx.pack_paths["Test/Pack"], "mods/Test'Pack/rom/mod_pv_db.txt")
+        self.assertEqual(sorted(self.ctx.mod_pv_list), sorted(self.ctx.pack_paths.values()))
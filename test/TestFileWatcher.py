@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from ..FileWatcher import FileWatcher
+
+
+class TestFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.results_path = os.path.join(self.directory.name, "results.json")
+        self.log_path = os.path.join(self.directory.name, "results.jsonl")
+        with open(self.results_path, "w") as file:
+            file.write("{}")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, file_path: str, mtime_ns: int):
+        with open(file_path, "w") as file:
+            file.write("{}")
+        # Set the mtime so writes within the filesystem's timestamp granularity still count as changes
+        os.utime(file_path, ns=(mtime_ns, mtime_ns))
+
+    def test_polling_changes(self):
+        async def run():
+            watcher = FileWatcher([self.results_path, self.log_path], 0.01)
+            changes = watcher.polling_changes()
+            # The first poll only takes the modification times
+            first = asyncio.ensure_future(changes.__anext__())
+            await asyncio.sleep(0.03)
+            self.write(self.results_path, 1_000_000_000)
+            self.assertEqual(await asyncio.wait_for(first, 2), self.results_path)
+
+            # A file created after the watcher started counts as written
+            self.write(self.log_path, 2_000_000_000)
+            self.assertEqual(await asyncio.wait_for(changes.__anext__(), 2), self.log_path)
+            await changes.aclose()
+
+        asyncio.run(run())
+
+    def test_changes_falls_back_to_polling(self):
+        async def run():
+            watcher = FileWatcher([self.results_path], 0.01)
+            with mock.patch.object(watcher, "open_inotify", return_value=None):
+                changes = watcher.changes()
+                first = asyncio.ensure_future(changes.__anext__())
+                await asyncio.sleep(0.03)
+                self.write(self.results_path, 3_000_000_000)
+                self.assertEqual(await asyncio.wait_for(first, 2), (self.results_path, 3_000_000_000))
+                self.assertEqual(watcher.mode, "polling")
+                await changes.aclose()
+
+        asyncio.run(run())
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_inotify_changes(self):
+        async def run():
+            watcher = FileWatcher([self.results_path], 10)
+            changes = watcher.changes()
+            first = asyncio.ensure_future(changes.__anext__())
+            await asyncio.sleep(0.05)
+            if watcher.mode != "inotify":
+                first.cancel()
+                self.skipTest("inotify is unavailable here")
+            self.write(self.results_path, 4_000_000_000)
+            self.assertEqual(await asyncio.wait_for(first, 2), (self.results_path, 4_000_000_000))
+            await changes.aclose()
+
+        asyncio.run(run())
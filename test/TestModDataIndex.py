@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .. import DataHandler
+from ..DataHandler import extract_mod_data_to_json
+
+
+def player_yaml(name: str, songs: list) -> str:
+    mod_data = json.dumps({"Pack": songs})
+    return f"name: {name}\ngame: Hatsune Miku Project Diva Mega Mix+\nHatsune Miku Project Diva Mega Mix+:\n  megamix_mod_data: '{mod_data}'\n"
+
+
+class TestModDataIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.players = os.path.join(self.directory.name, "Players")
+        self.index_path = os.path.join(self.directory.name, "cache", "mod_data_index.json")
+        os.makedirs(self.players)
+        self.write("Player1.yaml", player_yaml("Player1", [["Song", 5000, 200]]))
+        self.write("Other.yaml", "name: Other\ngame: Clique\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name: str, content: str):
+        with open(os.path.join(self.players, name), "w", encoding="utf-8") as file:
+            file.write(content)
+
+    def extract(self):
+        with mock.patch.object(DataHandler.yaml, "safe_load_all", wraps=DataHandler.yaml.safe_load_all) as safe_load_all:
+            mod_data = extract_mod_data_to_json(self.players, self.index_path)
+        return mod_data, safe_load_all.call_count
+
+    def test_unchanged_files_are_not_parsed_again(self):
+        self.assertEqual(self.extract(), ([{"Pack": [["Song", 5000, 200]]}], 1))
+        self.assertEqual(self.extract(), ([{"Pack": [["Song", 5000, 200]]}], 0))
+
+    def test_changed_and_removed_files(self):
+        self.extract()
+        self.write("Player1.yaml", player_yaml("Player1", [["Song", 5000, 200], ["Another song", 5001, 300]]))
+        self.write("Player2.yaml", player_yaml("Player2", [["Cover", 1, 100]]))
+        mod_data, parsed = self.extract()
+        self.assertEqual(parsed, 2)
+        self.assertEqual(sorted(len(data["Pack"]) for data in mod_data), [1, 2])
+
+        os.remove(os.path.join(self.players, "Player2.yaml"))
+        mod_data, parsed = self.extract()
+        self.assertEqual((len(mod_data), parsed), (1, 0))
+        with open(self.index_path, encoding="utf-8") as file:
+            self.assertEqual(len(json.load(file)), 2)
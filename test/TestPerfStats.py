@@ -0,0 +1,30 @@
+import unittest
+
+from ..PerfStats import PerfStats
+
+
+class TestPerfStats(unittest.TestCase):
+    def test_summary(self):
+        stats = PerfStats()
+        for milliseconds in range(1, 101):
+            stats.record("sync", milliseconds / 1000)
+        stats.add_bytes("mod_pv_db.txt", read=100)
+        stats.add_bytes("mod_pv_db.txt", written=3)
+
+        summary = stats.summary()
+        self.assertEqual(summary["spans"]["sync"]["count"], 100)
+        self.assertAlmostEqual(summary["spans"]["sync"]["total_ms"], 5050)
+        self.assertAlmostEqual(summary["spans"]["sync"]["p50_ms"], 50)
+        self.assertAlmostEqual(summary["spans"]["sync"]["p95_ms"], 95)
+        self.assertEqual(summary["packs"]["mod_pv_db.txt"], {"bytes_read": 100, "bytes_written": 3})
+
+    def test_span_decorator(self):
+        stats = PerfStats()
+
+        @stats.span("work")
+        def work():
+            pass
+
+        work()
+        work()
+        self.assertEqual(stats.summary()["spans"]["work"]["count"], 2)
@@ -0,0 +1,37 @@
+import unittest
+
+from NetUtils import NetworkItem
+
+from ..Client import ProgressTracker
+
+
+class TestProgressTracker(unittest.TestCase):
+    def setUp(self):
+        self.progress = ProgressTracker()
+        song_locations = {1: (10, 11), 2: (20, 21), 3: (30, 31)}
+        self.progress.set_locations(song_locations, [20, 21, 30, 31], [10, 11])
+
+    def test_receive_items_from_cursor(self):
+        items = [NetworkItem(10, 1, 1), NetworkItem(1, 2, 1), NetworkItem(20, 3, 1)]
+        self.assertEqual(len(self.progress.receive_items(items)), 3)
+        items.append(NetworkItem(1, 4, 1))
+        self.assertEqual(self.progress.receive_items(items), [items[3]])
+        self.assertEqual(self.progress.leeks, 2)
+        self.assertEqual(self.progress.received_songs, {1, 2})
+        self.assertEqual(self.progress.uncleared_songs, {2})
+
+    def test_resync_counts_once(self):
+        items = [NetworkItem(1, 1, 1), NetworkItem(1, 2, 1)]
+        self.progress.receive_items(items)
+        self.progress.reset_items()
+        self.progress.receive_items(items)
+        self.assertEqual(self.progress.leeks, 2)
+
+    def test_check_locations(self):
+        self.progress.receive_items([NetworkItem(20, 1, 1), NetworkItem(30, 2, 1)])
+        self.progress.check_locations([20])
+        self.assertEqual(self.progress.uncleared_songs, {2, 3})
+        self.progress.check_locations([21])
+        self.assertEqual(self.progress.uncleared_songs, {3})
+        self.assertEqual(self.progress.cleared_songs, {1, 2})
+        self.assertEqual(self.progress.missing, {30, 31})
@@ -0,0 +1,205 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .. import DataHandler
+from ..DataHandler import PvDb, create_copies, reconcile_song_list, restore_originals, scan_difficulty_lines, sibling_path
+
+PV_DB = (
+    "pv_001.difficulty.easy.length=1\n"
+    "pv_001.difficulty.encore.length=0\n"
+    "pv_001.difficulty.extreme.length=2\n"
+    "pv_001.song_name_en=Love is War\n"
+    "pv_144.difficulty.hard.length=1\n"
+    "pv_4950.difficulty.normal.length=1\n"
+)
+
+
+class TestPvDb(unittest.TestCase):
+    def setUp(self):
+        self.backup_store = tempfile.TemporaryDirectory()
+        backup_store_patch = mock.patch.object(DataHandler, "BACKUP_STORE", self.backup_store.name)
+        backup_store_patch.start()
+        self.addCleanup(backup_store_patch.stop)
+        handle, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "w", encoding="utf-8", newline="") as file:
+            file.write(PV_DB)
+
+    def tearDown(self):
+        for path in (self.path, sibling_path(self.path, "COPY"), sibling_path(self.path, "JOURNAL", ".json"),
+                     sibling_path(self.path, "BACKUP", ".json")):
+            if os.path.exists(path):
+                os.remove(path)
+        self.backup_store.cleanup()
+
+    def read(self) -> str:
+        with open(self.path, "r", encoding="utf-8", newline="") as file:
+            return file.read()
+
+    def backup_blobs(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.backup_store.name) if name.endswith(".zlib"))
+
+    def write(self, pv_db: str):
+        with open(self.path, "w", encoding="utf-8", newline="") as file:
+            file.write(pv_db)
+
+    def test_index(self):
+        pv_db = PvDb(self.path)
+        self.assertEqual({1: [0, 66], 144: [133], 4950: [165]}, pv_db.index)
+
+    def test_lock_unlock_round_trip(self):
+        pv_db = PvDb(self.path)
+        self.assertEqual(2, pv_db.lock({1}))
+        pv_db.save()
+        self.assertIn("#A#001.difficulty.easy.length=1\n", self.read())
+        self.assertEqual(len(PV_DB), len(self.read()))
+        self.assertIn("pv_001.difficulty.encore.length=0\n", self.read())
+
+        self.assertEqual(2, pv_db.unlock({1}))
+        pv_db.save()
+        self.assertEqual(PV_DB, self.read())
+
+    def test_lock_others_skips_protected(self):
+        pv_db = PvDb(self.path)
+        pv_db.update(unlock_ids={4950}, others=True)
+        pv_db.save()
+        self.assertIn("\npv_144.difficulty.hard.length=1\n", self.read())
+        self.assertIn("\npv_4950.difficulty.normal.length=1\n", self.read())
+
+    def test_no_write_without_changes(self):
+        pv_db = PvDb(self.path)
+        pv_db.unlock({1})
+        self.assertFalse(pv_db.dirty)
+
+    def test_crlf(self):
+        self.write(PV_DB.replace("\n", "\r\n"))
+        pv_db = PvDb(self.path)
+        pv_db.lock({4950})
+        pv_db.save()
+        self.assertTrue(self.read().endswith("#A#4950.difficulty.normal.length=1\r\n"))
+
+    def test_toggle_back_cancels_write(self):
+        pv_db = PvDb(self.path)
+        pv_db.lock({1})
+        pv_db.unlock({1})
+        self.assertFalse(pv_db.dirty)
+
+    def test_migrate_legacy_locks(self):
+        self.write(PV_DB.replace("pv_001.difficulty.easy", "#ARCH#pv_001.difficulty.easy"))
+        pv_db = PvDb(self.path)
+        self.assertIn("#A#001.difficulty.easy.length=1\n", self.read())
+        pv_db.unlock({1})
+        pv_db.save()
+        self.assertEqual(PV_DB, self.read())
+
+    def test_journal_tracks_locks(self):
+        journal_path = sibling_path(self.path, "JOURNAL", ".json")
+        pv_db = PvDb(self.path)
+        pv_db.lock({1, 4950})
+        pv_db.save()
+        self.assertTrue(os.path.exists(journal_path))
+
+        pv_db.unlock({1, 4950})
+        pv_db.save()
+        self.assertFalse(os.path.exists(journal_path))
+
+    def test_restore_from_journal(self):
+        pv_db = PvDb(self.path)
+        pv_db.update(others=True)
+        pv_db.save()
+        restore_originals([self.path])
+        self.assertEqual(PV_DB, self.read())
+        self.assertFalse(os.path.exists(sibling_path(self.path, "JOURNAL", ".json")))
+
+    def test_restore_from_legacy_copy(self):
+        with open(sibling_path(self.path, "COPY"), "w", encoding="utf-8", newline="") as file:
+            file.write(PV_DB)
+        self.write(PV_DB.replace("pv_001.difficulty.easy", "#ARCH#pv_001.difficulty.easy"))
+        restore_originals([self.path])
+        self.assertEqual(PV_DB, self.read())
+        self.assertFalse(os.path.exists(sibling_path(self.path, "COPY")))
+
+    def test_scan_skips_other_lines(self):
+        pv_db = (
+            b"pv_002.difficulty.encore.length=1\n"
+            b"pv_002.difficulty.easy.length=12\n"
+            b"pv_002.another_song.length=2\n"
+            b"#pv_002.difficulty.easy.length=1\n"
+            b"#ARCH#pv_002.difficulty.hard.length=1\r\n"
+            b"pv_002.difficulty.normal.length=1"
+        )
+        self.assertEqual([(129, b"#ARCH#pv_", 2), (168, b"pv_", 2)], list(scan_difficulty_lines(pv_db)))
+
+    def test_streaming_matches_whole_file(self):
+        self.write(PV_DB.replace("pv_001.difficulty.easy", "#ARCH#pv_001.difficulty.easy") * 50)
+        with mock.patch.object(DataHandler, "STREAM_CHUNK_SIZE", 37):
+            streamed = PvDb(self.path, streaming=True)
+        migrated = self.read()
+        self.write(PV_DB.replace("pv_001.difficulty.easy", "#ARCH#pv_001.difficulty.easy") * 50)
+        whole = PvDb(self.path, streaming=False)
+
+        self.assertEqual(migrated, self.read())
+        self.assertEqual(whole.index, streamed.index)
+        self.assertEqual(whole.locked, streamed.locked)
+
+    def test_restore_from_backup_when_journal_mismatches(self):
+        create_copies([self.path])
+        self.assertTrue(os.path.exists(sibling_path(self.path, "BACKUP", ".json")))
+
+        pv_db = PvDb(self.path)
+        pv_db.update(others=True)
+        pv_db.save()
+        # Something else grew the pack, so the journal's offsets can't be trusted
+        with open(self.path, "a", encoding="utf-8", newline="") as file:
+            file.write("pv_001.song_name=Love is War\n")
+
+        restore_originals([self.path])
+        self.assertEqual(PV_DB, self.read())
+
+    def test_identical_packs_share_backup(self):
+        handle, other_path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "w", encoding="utf-8", newline="") as file:
+            file.write(PV_DB)
+        self.addCleanup(os.remove, other_path)
+        self.addCleanup(os.remove, sibling_path(other_path, "BACKUP", ".json"))
+
+        with mock.patch.object(DataHandler, "reflink", return_value=False):
+            create_copies([self.path, other_path])
+        self.assertEqual(1, len(self.backup_blobs()))
+
+        # The other pack still uses the blob after this one changed
+        self.write(PV_DB + "pv_002.difficulty.easy.length=1\n")
+        with mock.patch.object(DataHandler, "reflink", return_value=False):
+            create_copies([self.path])
+        self.assertEqual(2, len(self.backup_blobs()))
+
+    def test_replaced_backup_blob_is_deleted(self):
+        with mock.patch.object(DataHandler, "reflink", return_value=False):
+            create_copies([self.path])
+            first_blobs = self.backup_blobs()
+            self.write(PV_DB + "pv_002.difficulty.easy.length=1\n")
+            create_copies([self.path])
+
+        self.assertEqual(1, len(self.backup_blobs()))
+        self.assertNotEqual(first_blobs, self.backup_blobs())
+        restore_originals([self.path])
+        self.assertEqual(PV_DB + "pv_002.difficulty.easy.length=1\n", self.read())
+
+    def test_reconcile_song_list(self):
+        missing_path = os.path.join(os.path.dirname(self.path), "missing_pack", "mod_pv_db.txt")
+        changes = reconcile_song_list({self.path: (set(), set(), True), missing_path: (set(), set(), True)})
+        self.assertEqual({self.path: 3}, changes)
+        self.assertIn("pv_144.difficulty.hard.length=1\n", self.read())
+        self.assertNotIn("pv_001.difficulty.easy", self.read())
+
+        self.assertEqual({self.path: 2}, reconcile_song_list({self.path: ({1}, set(), True)}))
+        self.assertEqual({self.path: 0}, reconcile_song_list({self.path: ({1}, set(), True)}))
+        self.assertIn("pv_001.difficulty.easy.length=1\n", self.read())
+        self.assertIn("#A#4950.difficulty.normal.length=1\n", self.read())
+
+    def test_create_copies_skips_missing_packs(self):
+        missing_path = os.path.join(os.path.dirname(self.path), "missing_pack", "mod_pv_db.txt")
+        with mock.patch.object(DataHandler, "reflink", return_value=False):
+            create_copies([missing_path, self.path])
+        self.assertEqual(1, len(self.backup_blobs()))
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+
+from ..DataHandler import ResultsLog
+
+
+def result(seq: int, pv_id: int) -> str:
+    return json.dumps({"seq": seq, "pvId": pv_id, "scoreGrade": 4}) + "\n"
+
+
+class TestResultsLog(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(handle, "w") as file:
+            file.write(result(1, 1))
+        self.position_path = f"{self.path}.position"
+        self.log = ResultsLog(self.path, self.position_path)
+
+    def tearDown(self):
+        os.remove(self.path)
+        if os.path.exists(self.position_path):
+            os.remove(self.position_path)
+
+    def append(self, data: str):
+        with open(self.path, "a") as file:
+            file.write(data)
+
+    def test_skips_existing_records(self):
+        self.assertEqual(self.log.read_new(), [])
+
+    def test_reads_new_records_in_order(self):
+        self.append(result(2, 2) + result(3, 3))
+        self.assertEqual([record["pvId"] for record in self.log.read_new()], [2, 3])
+        self.assertEqual(self.log.read_new(), [])
+
+    def test_waits_for_complete_line(self):
+        line = result(2, 2)
+        self.append(line[:10])
+        self.assertEqual(self.log.read_new(), [])
+        self.append(line[10:])
+        self.assertEqual([record["pvId"] for record in self.log.read_new()], [2])
+
+    def test_skips_repeated_sequence(self):
+        self.append(result(2, 2) + result(2, 2) + "not json\n" + result(3, 3))
+        self.assertEqual([record["seq"] for record in self.log.read_new()], [2, 3])
+
+    def test_truncated_file_starts_over(self):
+        self.append(result(2, 2))
+        self.log.read_new()
+        with open(self.path, "w") as file:
+            file.write(result(1, 5))
+        self.assertEqual([record["pvId"] for record in self.log.read_new()], [5])
+
+    def test_restarted_sequence_is_a_new_run(self):
+        self.append(result(2, 2) + result(3, 3))
+        self.log.read_new()
+        self.append(result(1, 4) + result(1, 4) + result(2, 5))
+        self.assertEqual([record["pvId"] for record in self.log.read_new()], [4, 5])
+
+    def test_resume_reads_results_from_while_closed(self):
+        self.append(result(2, 2))
+        self.log.read_new()
+        self.log.save_position()
+
+        self.append(result(3, 3) + result(3, 3))
+        log = ResultsLog(self.path, self.position_path)
+        self.assertTrue(log.resume())
+        self.assertEqual([record["pvId"] for record in log.read_new()], [3])
+
+    def test_no_resume_after_reading(self):
+        self.log.save_position()
+        self.append(result(2, 2))
+        self.assertEqual(len(self.log.read_new()), 1)
+        self.assertFalse(self.log.resume())
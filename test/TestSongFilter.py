@@ -0,0 +1,46 @@
+import unittest
+
+from .. import MegaMixWorld
+from ..MegaMixCollection import get_relaxation_steps
+
+
+class TestSongFilter(unittest.TestCase):
+    def test_counts_match_filter(self):
+        collection = MegaMixWorld.mm_collection
+        song_keys = collection.get_songs_without_difficulty(True, [], [])
+        steps = [(6, 7, 3, 3), (5.5, 7, 3, 3), (5.5, 7.5, 3, 3), (6, 7, 2, 3), (1, 10, 0, 4)]
+
+        counts = collection.count_songs_per_step(song_keys, steps)
+        for (lower, higher, diff_lower, diff_higher), count in zip(steps, counts):
+            allowed = list(range(diff_lower, diff_higher + 1))
+            self.assertEqual(count, len(collection.filter_songs_by_difficulty(song_keys, allowed, lower, higher)))
+
+    def test_filter_keeps_catalog_order(self):
+        collection = MegaMixWorld.mm_collection
+        filtered = collection.get_songs_with_settings(True, [], [0, 1, 2, 3, 4], [], 1, 10)
+        order = list(collection.song_items)
+        self.assertEqual(list(filtered), sorted(filtered, key=order.index))
+
+    def test_filter_cache(self):
+        collection = MegaMixWorld.mm_collection
+        misses = collection.filter_cache_misses
+        first = collection.get_songs_with_settings(False, [], [3, 2], ["KAITO"], 5, 8)
+        hits = collection.filter_cache_hits
+        second = collection.get_songs_with_settings(0, [], [2, 3], {"KAITO"}, 5.0, 8.0)
+
+        self.assertIs(first, second)
+        self.assertIsInstance(first, tuple)
+        self.assertEqual(collection.filter_cache_misses, misses + 1)
+        self.assertEqual(collection.filter_cache_hits, hits + 1)
+
+    def test_preview_matches_filter(self):
+        collection = MegaMixWorld.mm_collection
+        count = collection.count_songs_with_settings(False, [], [2, 3], ["KAITO"], 5, 7)
+        self.assertEqual(count, len(collection.get_songs_with_settings(False, [], [2, 3], ["KAITO"], 5, 7)))
+
+        song_keys = list(collection.get_songs_without_difficulty(False, [], ["KAITO"]))
+        steps = get_relaxation_steps((5, 7), (2, 3))
+        counts = collection.count_songs_per_step(song_keys, steps)
+        for needed in [1, count + 1, counts[-1], counts[-1] + 1]:
+            step = collection.find_relaxation_step(False, [], ["KAITO"], (5, 7), (2, 3), needed)
+            self.assertEqual(step, next((i for i, n in enumerate(counts) if n >= needed), None))